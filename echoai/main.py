@@ -4,8 +4,16 @@
 
 import sys
 import os
+import io
+import codecs
 import json
+import re
+import selectors
 import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache, partial
 from prompt_toolkit import PromptSession
 from prompt_toolkit.enums import EditingMode
 from prompt_toolkit.key_binding import KeyBindings
@@ -13,7 +21,7 @@ from prompt_toolkit.styles import Style
 from prompt_toolkit.completion import PathCompleter
 from prompt_toolkit.shortcuts import CompleteStyle, prompt
 from prompt_toolkit.keys import Keys
-from prompt_toolkit.application import Application
+from prompt_toolkit.application import Application, get_app
 from prompt_toolkit.buffer import Buffer
 from prompt_toolkit.layout import Layout
 from prompt_toolkit.layout.containers import HSplit, VSplit, Window
@@ -24,12 +32,43 @@ from rich.console import Console
 from rich.markdown import Markdown
 from rich.table import Table
 from rich.live import Live
+from rich.markup import escape
 from openai import OpenAI
 from ollama import Client
 from pathlib import Path
-import magic
-import PyPDF2
-import docx
+
+# Matches inline /file references, with an optional path argument
+file_reference_pattern = re.compile(r"/file\s*(\S+)?")
+
+# MIME types for common extensions, checked before falling back to libmagic
+extension_mime_types = {
+    ".pdf": "application/pdf",
+    ".doc": "application/msword",
+    ".docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    ".txt": "text/plain",
+    ".md": "text/markdown",
+    ".rst": "text/x-rst",
+    ".log": "text/plain",
+    ".csv": "text/csv",
+    ".json": "text/plain",
+    ".yaml": "text/plain",
+    ".yml": "text/plain",
+    ".html": "text/html",
+    ".py": "text/x-python",
+}
+
+# Document types whose parsed text is cached, parsing them is far slower than reading plain text
+document_mime_types = (
+    "application/pdf",
+    "application/msword",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+)
+
+# PDFs with at least this many pages are extracted across worker processes
+pdf_parallel_min_pages = 16
+
+# Text attachments are truncated past this size, far beyond any model context window
+max_text_bytes = 10 * 1024 * 1024
 
 # Path to the config file
 config_path = Path.home() / ".echoai"
@@ -248,8 +287,28 @@ def load_config():
 
 # Save configuration to the file
 def save_config(config):
-    with open(config_path, "w") as f:
-        json.dump(config, f, indent=4)
+    # Write to a temporary file and swap it in, so an interrupted save never truncates the config
+    # Resolve first so a symlinked config (e.g. from a dotfile manager) keeps its link
+    target_path = config_path.resolve()
+    with tempfile.NamedTemporaryFile("w", dir=target_path.parent, prefix=".echoai.", delete=False) as f:
+        try:
+            json.dump(config, f, indent=4)
+        except BaseException:
+            f.close()
+            os.unlink(f.name)
+            raise
+    os.replace(f.name, target_path)
+
+# Snapshot of every persisted setting, so partial updates don't drop the others
+def current_config():
+    return {
+        "model": model,
+        "system_prompt": system_prompt,
+        "show_hidden_files": show_hidden_files,
+        "theme": theme_name,
+        "username": username,
+        "markdown": markdown
+    }
 
 # Initialize configuration on load
 load_config()
@@ -272,7 +331,8 @@ console = Console()
 # Prepare the command registry
 command_registry = {}
 
-messages = []
+# Chat history sent with every request, the system prompt is kept at index 0
+messages = [{"role": "system", "content": system_prompt}]
 
 # Command decorator to register commands easily with descriptions
 def command(name, description="No description provided."):
@@ -281,69 +341,148 @@ def command(name, description="No description provided."):
         return func
     return decorator
 
+# File parsers are imported on first use, keeping them off startup and the plain chat path
+@lru_cache(maxsize=None)
+def get_mime_detector():
+    """Shared libmagic handle, loading the magic database once instead of per file."""
+    import magic
+    return magic.Magic(mime=True)
+
 def extract_text_from_file(file_path):
-    """Extract text from supported file types using magic to determine the file type."""
+    """Extract text using magic to determine the file type."""
     file_path = Path(file_path)
 
-    # Determine MIME type using magic
-    mime_type = magic.from_file(str(file_path), mime=True)
-
-    if mime_type == "application/pdf":
-        text = ""
+    # Known extensions skip content sniffing, otherwise use magic on the file header
+    mime_type = extension_mime_types.get(file_path.suffix.lower())
+    if mime_type is None:
         with file_path.open("rb") as f:
-            pdf_reader = PyPDF2.PdfReader(f)
-            for page in pdf_reader.pages:
-                text += page.extract_text()
-        return text
+            header = f.read(4096)
+        mime_type = get_mime_detector().from_buffer(header)
 
-    elif mime_type in ["application/msword", "application/vnd.openxmlformats-officedocument.wordprocessingml.document"]:
-        doc = docx.Document(file_path)
-        return "\n".join([para.text for para in doc.paragraphs])
+    if mime_type in document_mime_types:
+        # Only the slow document parses are cached, text is re-read so pseudo-files like /proc/uptime stay current
+        stat = file_path.stat()
+        return extract_document_cached(str(file_path), mime_type, stat.st_mtime_ns, stat.st_size)
 
     elif mime_type.startswith("text"):
-        return file_path.read_text()
+        # A bounded read works for pseudo-files too, which may report a wrong size and cannot be mapped
+        with file_path.open("rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            data = f.read(max_text_bytes + 1)
+        # Decode as UTF-8 instead of the locale encoding
+        if len(data) <= max_text_bytes:
+            return data.decode("utf-8", errors="replace")
+        text = data[:max_text_bytes].decode("utf-8", errors="replace")
+        total = f" of {size}" if size > max_text_bytes else ""
+        return f"{text}\n[Truncated: showing the first {max_text_bytes}{total} bytes]"
 
     else:
-        display("error", f"Unsupported file type '{mime_type}'")
+        # Raised rather than displayed so the failure is reported by the caller
+        raise ValueError(f"Unsupported file type '{mime_type}'")
+
+@lru_cache(maxsize=32)
+def extract_document_cached(file_path, mime_type, mtime_ns, size):
+    """Parse a PDF or Word document, reusing earlier results. mtime_ns and size only key the cache."""
+    file_path = Path(file_path)
+
+    if mime_type == "application/pdf":
+        try:
+            import pypdfium2 as pdfium
+        except ImportError:
+            pdfium = None
+
+        if pdfium is not None:
+            # PDFium is C-backed and much faster per page than PyPDF2
+            pdf = pdfium.PdfDocument(str(file_path))
+            try:
+                return "".join(pdf[i].get_textpage().get_text_range() for i in range(len(pdf)))
+            finally:
+                pdf.close()
+
+        import PyPDF2
+        pdf_bytes = file_path.read_bytes()
+        pdf_reader = PyPDF2.PdfReader(io.BytesIO(pdf_bytes))
+        page_count = len(pdf_reader.pages)
+
+        if page_count >= pdf_parallel_min_pages:
+            # PyPDF2 is pure Python and holds the GIL, so split page ranges across processes
+            # The worker lives in echoai.pdf so spawned workers don't re-import this module
+            from echoai.pdf import extract_pdf_pages
+            workers = min(os.cpu_count() or 1, 4)
+            step = -(-page_count // workers)
+            starts = range(0, page_count, step)
+            stops = [min(start + step, page_count) for start in starts]
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                return "".join(executor.map(partial(extract_pdf_pages, pdf_bytes), starts, stops))
+
+        return "".join(page.extract_text() or "" for page in pdf_reader.pages)
+
+    else:
+        import docx
+        doc = docx.Document(file_path)
+        return "\n".join([para.text for para in doc.paragraphs])
 
 def prompt_file_selection():
     """Terminal-based file browser using prompt_toolkit to navigate and select files."""
     current_path = Path.home()  # Start in the user's home directory
-    files = []
+    files = []  # (name, is_dir, path) tuples for the current directory
+    display_names = []  # Row labels for `files`, computed once per directory load
+    display_cache = {"key": None, "text": []}  # Last formatted view, reused across redraws
     selected_index = 0  # Track the selected file/folder index
     scroll_offset = 0  # Track the starting point of the visible list
     show_hidden = False  # Initialize hidden files visibility
 
-    terminal_height = int(os.get_terminal_size().lines / 2)
-    max_display_lines = terminal_height - 2  # Reduce by 2 for header and footer lines
+    def max_display_lines():
+        """Rows available for the file list, read on each render so resizes are picked up."""
+        # Reduce by 4 for the framed header (3 lines) and the footer
+        return max(1, get_app().output.get_size().rows - 4)
 
     def update_file_list():
         """Update the list of files in the current directory, with '..' as the first entry to go up."""
-        nonlocal files, selected_index, scroll_offset
-        # List current directory contents and insert '..' at the top for navigating up
-        all_files = [".."] + sorted(current_path.iterdir(), key=lambda p: (not p.is_dir(), p.name.lower()))
+        nonlocal files, display_names, selected_index, scroll_offset
+        # scandir reports entry types from the directory read itself, avoiding a stat per file
+        # Hidden files are filtered out if `show_hidden` is False
+        with os.scandir(current_path) as it:
+            entries = [(e.name, e.is_dir(), e.path) for e in it if show_hidden or not e.name.startswith('.')]
+        entries.sort(key=lambda e: (not e[1], e[0].lower()))
+
+        # Insert '..' at the top for navigating up
+        files = [("..", True, str(current_path.parent))] + entries
 
-        # Filter out hidden files if `show_hidden` is False
-        files = [f for f in all_files if isinstance(f, str) or show_hidden or not f.name.startswith('.')]
+        # Build the row labels here so redraws never stat the filesystem
+        display_names = [".."] + [name + ("/" if is_dir else "") for name, is_dir, _ in entries]
+        display_cache["key"] = None
 
         selected_index = 0
         scroll_offset = 0
 
     def get_display_text():
         """Display text for the current directory contents with the selected item highlighted."""
+        nonlocal scroll_offset
+        display_lines = max_display_lines()
+
+        # Scroll so the selection stays visible after moves, wrap-arounds and resizes
+        if selected_index < scroll_offset:
+            scroll_offset = selected_index
+        elif selected_index >= scroll_offset + display_lines:
+            scroll_offset = selected_index - display_lines + 1
+
+        # prompt_toolkit redraws far more often than the selection changes
+        key = (selected_index, scroll_offset, display_lines)
+        if display_cache["key"] == key:
+            return display_cache["text"]
+
         text = []
-        visible_files = files[scroll_offset:scroll_offset + max_display_lines]
-        for i, f in enumerate(visible_files):
+        visible_names = display_names[scroll_offset:scroll_offset + display_lines]
+        for i, display_name in enumerate(visible_names):
             real_index = scroll_offset + i
             prefix = "> " if real_index == selected_index else "  "
-            
-            # Use only the file or directory name for display
-            display_name = f if isinstance(f, str) else f.name
-            display_name += "/" if isinstance(f, Path) and f.is_dir() else ""
-            
             line = f"{prefix}{display_name}"
             text.append((f"{'yellow' if real_index == selected_index else 'white'}", line))
             text.append(('', '\n'))
+
+        display_cache["key"] = key
+        display_cache["text"] = text
         return text
 
     # Initialize file list with the home directory contents
@@ -352,38 +491,29 @@ def prompt_file_selection():
     # Key bindings
     kb = KeyBindings()
 
+    # Scrolling to keep the selection visible is handled in get_display_text
     @kb.add("up")
     def move_up(event):
-        nonlocal selected_index, scroll_offset
+        nonlocal selected_index
         selected_index = (selected_index - 1) % len(files)
-        # Scroll up if the selection goes above the visible area
-        if selected_index < scroll_offset:
-            scroll_offset = max(0, scroll_offset - 1)
 
     @kb.add("down")
     def move_down(event):
-        nonlocal selected_index, scroll_offset
+        nonlocal selected_index
         selected_index = (selected_index + 1) % len(files)
-        # Scroll down if the selection goes beyond the visible area
-        if selected_index >= scroll_offset + max_display_lines:
-            scroll_offset = min(len(files) - max_display_lines, scroll_offset + 1)
 
     @kb.add("enter")
     def enter_directory(event):
         nonlocal current_path
-        selected_file = files[selected_index]
+        name, is_dir, path = files[selected_index]
 
-        if selected_file == "..":
-            # Move up to the parent directory
-            current_path = current_path.parent
-            update_file_list()
-        elif isinstance(selected_file, Path) and selected_file.is_dir():
-            # Enter the selected directory
-            current_path = selected_file
+        if is_dir:
+            # Enter the selected directory, or move up to the parent for '..'
+            current_path = Path(path)
             update_file_list()
-        elif isinstance(selected_file, Path) and selected_file.is_file():
+        elif os.path.isfile(path):
             # Select the file and exit
-            event.app.exit(result=str(selected_file))  # Return the file path as a string
+            event.app.exit(result=path)  # Return the file path as a string
 
     @kb.add("escape")
     def cancel_selection(event):
@@ -397,7 +527,7 @@ def prompt_file_selection():
         update_file_list()
 
     # Layout with footer for shortcut hint
-    file_list_window = Window(content=FormattedTextControl(get_display_text), wrap_lines=False, height=max_display_lines)
+    file_list_window = Window(content=FormattedTextControl(get_display_text), wrap_lines=False, height=Dimension(min=1, weight=1))
     footer_window = Window(content=FormattedTextControl(lambda: "Press Ctrl-H to show/hide hidden files. Escape to exit."), height=1, style=style_dict['footer'])
     layout = Layout(HSplit([
         Frame(Window(FormattedTextControl(lambda: f"Current Directory: {current_path}"), height=1)),
@@ -406,15 +536,13 @@ def prompt_file_selection():
     ]))
 
     # Application
-    app = Application(layout=layout, key_bindings=kb, full_screen=True, refresh_interval=0.1)
+    app = Application(layout=layout, key_bindings=kb, full_screen=True)
 
     # Run the application and return the selected file path (or None if canceled)
     return app.run()
 
 def replace_file_references(text):
     """Replace /file <path> with the contents of the specified file in the text."""
-    import re
-
     def file_replacement(match):
         file_path = match.group(1).strip() if match.group(1) else ""
         
@@ -437,7 +565,7 @@ def replace_file_references(text):
             return f"[Error: could not read file {file_path}]"
 
     # Replace /file with content, return None if any replacement is cancelled
-    result = re.sub(r"/file\s*([^\s]+)?", lambda match: file_replacement(match) or "[Cancelled]", text)
+    result = file_reference_pattern.sub(lambda match: file_replacement(match) or "[Cancelled]", text)
     if "[Cancelled]" in result:
         return None
     return result
@@ -494,13 +622,7 @@ def theme_command(contents=None):
         display("output", f"Theme set to|set|{theme_name}.")
         
         # Save the selected theme to config
-        save_config({
-            "model": model,
-            "system_prompt": system_prompt,
-            "show_hidden_files": show_hidden_files,
-            "theme": theme_name,
-            "markdown": markdown,
-        })
+        save_config(current_config())
 
         # Re-create the session to apply the new style
         #session = PromptSession(editing_mode=EditingMode.VI, key_bindings=kb, style=style)
@@ -534,8 +656,8 @@ def file_command(contents=''):
         display("highlight", f"File selection cancelled or not processed.")
         return False
 
-    # Pass the processed input to ask_ai function
-    response = ask_ai(processed_text)
+    # Pass the processed input to ask_ai function, file references are already resolved
+    response = ask_ai(processed_text, resolve_files=False)
 
     return False
 
@@ -547,10 +669,11 @@ def system_command(contents=None):
     new_prompt = input("> ").strip()
     if new_prompt:
         system_prompt = new_prompt
+        messages[0]["content"] = system_prompt
         display("output", f"System prompt updated to:|set|{system_prompt}")
         
         # Update the configuration file with the new system prompt
-        save_config({"model": model, "system_prompt": system_prompt})
+        save_config(current_config())
     else:
         display("error", f"System prompt cannot be empty!")
     return False
@@ -561,39 +684,67 @@ def show_system_command(contents=None):
     display("highlight", f"Current system prompt:|set|{system_prompt}")
     return False
 
+@lru_cache(maxsize=256)
+def render_markdown(content):
+    """Parse an assistant reply into Markdown once, history entries never change after they are added."""
+    return Markdown(content)
+
 @command("/history", description="Show the chat history.")
 def history_command(contents=None):
     """Handle the /history command showing the history of the chat."""
-    if not messages:
+    if len(messages) == 1:
         display("highlight", f"No chat history available.")
     else:
-        for msg in messages:
-            role = "[bold green]{username}:[/bold green]" if msg["role"] == "user" else "[bold blue]Assistant:[/bold blue]"
+        for msg in messages[1:]:  # Skip the system prompt
+            role = f"[bold green]{username}:[/bold green]" if msg["role"] == "user" else "[bold blue]Assistant:[/bold blue]"
             console.print(role)  # Display role with color
-            console.print(Markdown(msg["content"]))  # Display content formatted as Markdown
+            # Only assistant replies are cached, user messages can carry attached files of up to max_text_bytes
+            rendered = render_markdown(msg["content"]) if msg["role"] == "assistant" else Markdown(msg["content"])
+            console.print(rendered)  # Display content formatted as Markdown
     return False
 
-# Update the model and save to config when selecting from models
-@command("/models", description="Select the AI model to use.")
-def models_command(contents=None):
-    global model
-    models = []
+# Cached model listing per provider, each refreshed once it is older than models_cache_ttl seconds
+models_cache = {
+    "openai": {"timestamp": 0.0, "models": None},
+    "ollama": {"timestamp": 0.0, "models": None},
+}
+models_cache_ttl = 300
 
-    # Gather OpenAI available models
+def list_openai_models():
+    """Return the available OpenAI models, or None if the API is unreachable."""
     try:
-        response = client.models.list()
-        for model_data in response:
-            models.append("openai:" + model_data.id)
+        return ["openai:" + model_data.id for model_data in client.models.list()]
     except Exception as e:
-        pass
+        return None
 
-    # Gather Ollama available models
+def list_ollama_models():
+    """Return the available Ollama models, or None if the server is unreachable."""
     try:
-        response = oclient.list()
-        for model_data in response['models']:
-            models.append("ollama:" + model_data['name'])
+        return ["ollama:" + model_data['name'] for model_data in oclient.list()['models']]
     except Exception as e:
-        pass
+        return None
+
+def list_models():
+    """Return all available models, concurrently querying only the providers whose cache is stale."""
+    listers = {"openai": list_openai_models, "ollama": list_ollama_models}
+    now = time.monotonic()
+    stale = [name for name, entry in models_cache.items() if entry["models"] is None or now - entry["timestamp"] >= models_cache_ttl]
+
+    if stale:
+        with ThreadPoolExecutor(max_workers=len(stale)) as executor:
+            futures = {name: executor.submit(listers[name]) for name in stale}
+            for name, future in futures.items():
+                # A provider that was down stays uncached, so only it is retried on the next call
+                models_cache[name]["models"] = future.result()
+                models_cache[name]["timestamp"] = time.monotonic()
+
+    return [model_name for entry in models_cache.values() if entry["models"] for model_name in entry["models"]]
+
+# Update the model and save to config when selecting from models
+@command("/models", description="Select the AI model to use.")
+def models_command(contents=None):
+    global model
+    models = list_models()
 
     if not models:
         display("error", "No models available.")
@@ -647,7 +798,7 @@ def models_command(contents=None):
         display("highlight", f"Selected model:|set|{model}")
         
         # Update the configuration file with the new model
-        save_config({"model": model, "system_prompt": system_prompt})
+        save_config(current_config())
         
         event.app.exit()
 
@@ -707,6 +858,7 @@ def settings_command(contents=None):
             model = value
         elif key == "system_prompt":
             system_prompt = value
+            messages[0]["content"] = system_prompt
         elif key == "show_hidden_files":
             show_hidden_files = value.lower() in ("true", "1", "yes")
         elif key == "theme" and value in themes:
@@ -725,14 +877,7 @@ def settings_command(contents=None):
             return False
         
         # Save the updated configuration
-        save_config({
-            "model": model,
-            "system_prompt": system_prompt,
-            "show_hidden_files": show_hidden_files,
-            "theme": theme_name,
-            "username": username,
-            "markdown": markdown
-        })
+        save_config(current_config())
         
         display("highlight", f"Updated {key} to:|set|{value}")
     else:
@@ -744,7 +889,8 @@ def settings_command(contents=None):
 def flush_command(contents=None):
     """Handle the /flush command to clear the chat history."""
     global messages
-    messages.clear()
+    del messages[1:]  # Keep the system prompt
+    render_markdown.cache_clear()  # Release the rendered replies along with the history
     display("highlight", f"Chat history has been flushed.")
 
     return False
@@ -772,96 +918,150 @@ def help_command(contents=None):
     console.print(table)
     return False  # Continue execution
 
-def ask_ai(text):
+def ask_ai(text, resolve_files=True):
     global model, markdown
-    text = replace_file_references(text)  # Replace any /file references with file contents
-    if text is None:
-        return None
+    if resolve_files:
+        text = replace_file_references(text)  # Replace any /file references with file contents
+        if text is None:
+            return None
 
     messages.append({"role": "user", "content": text})  # Add user message to history
-    request_messages = [{"role": "system", "content": system_prompt}] + messages
-    response = ''
+    parts = []  # Streamed deltas, joined once instead of growing a string per chunk
+    live = None
 
     if markdown is True:
-        live = Live(console=console, refresh_per_second=10)
+        rendered = {"count": -1, "markdown": None}
+
+        def render_response():
+            """Re-parse the Markdown only when new deltas arrived since the last refresh."""
+            count = len(parts)
+            if count != rendered["count"]:
+                rendered["markdown"] = Markdown("".join(parts[:count]))
+                rendered["count"] = count
+            return rendered["markdown"]
+
+        # Markdown is parsed on Live's refresh thread so the stream loop never waits on rendering
+        live = Live(console=console, refresh_per_second=10, get_renderable=render_response)
         live.start()
 
-    if model.startswith("openai"):
-        model_name = model.split(":")
-        current_model = model_name[1]
-        try:
-            stream = client.chat.completions.create(
-                model=current_model,
-                messages=request_messages,
-                stream=True,
-            )
-
-            for chunk in stream:
-                if chunk.choices[0].delta.content is not None:
-                    response += chunk.choices[0].delta.content
-                    if markdown is True:
-                        live.update(Markdown(response))
-                    else:
-                        print(chunk.choices[0].delta.content, end='', flush=True)
-        except Exception as e:
-            display("error", f"OpenAI error: {e}")
-            return "An error occurred while communicating with the LLM."
-
-    elif model.startswith("ollama"):
-        model_name = model.split(":")
-        current_model = model_name[1] + ":" + model_name[2]
-        try:
-            stream = oclient.chat(
-                model=current_model,
-                messages = request_messages,
-                stream=True,
-                options = { "num_ctx": 16000 },
-            )
-
-            for chunk in stream:
-                response += chunk['message']['content']
-                if markdown is True:
-                    live.update(Markdown(response))
-                else:
-                    print(chunk['message']['content'], end='', flush=True)
-        except Exception as e:
-            display("error", f"Ollama error: {e}")
-
-            return "An error occurred while communicating with the LLM."
+    try:
+        if model.startswith("openai"):
+            model_name = model.split(":")
+            current_model = model_name[1]
+            try:
+                stream = client.chat.completions.create(
+                    model=current_model,
+                    messages=messages,
+                    stream=True,
+                )
+
+                for chunk in stream:
+                    content = chunk.choices[0].delta.content
+                    if content is not None:
+                        parts.append(content)
+                        if live is None:
+                            print(content, end='', flush=True)
+            except Exception as e:
+                display("error", f"OpenAI error: {e}")
+                return "An error occurred while communicating with the LLM."
+
+        elif model.startswith("ollama"):
+            model_name = model.split(":")
+            current_model = model_name[1] + ":" + model_name[2]
+            try:
+                stream = oclient.chat(
+                    model=current_model,
+                    messages = messages,
+                    stream=True,
+                    options = { "num_ctx": 16000 },
+                )
+
+                for chunk in stream:
+                    content = chunk['message']['content']
+                    parts.append(content)
+                    if live is None:
+                        print(content, end='', flush=True)
+            except Exception as e:
+                display("error", f"Ollama error: {e}")
+
+                return "An error occurred while communicating with the LLM."
+    finally:
+        # Stopping Live performs the final render of the complete response
+        if live is not None and live.is_started:
+            live.stop()
 
+    response = "".join(parts)
     messages.append({"role": "assistant", "content": response.strip()})
 
     print()
 
-    try:
-        if live.is_started:
-            live.stop()
-    except:
-        pass
-
     return response.strip()
 
 def run_system_command(command):
-    """Run a system command, capture both stdout and stderr, and store output in messages."""
+    """Run a system command, streaming stdout and stderr as they arrive, and store output in messages."""
     try:
-        result = subprocess.run(command, shell=True, capture_output=True, text=True, executable="/bin/bash")
-        output = ""
+        process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, executable="/bin/bash")
 
-        if result.stdout:
-            output += f"{result.stdout}"
-            display("output", f"Output:|set|{result.stdout}")
+        # Per pipe: display style and label, incremental decoder, decoded chunks and the unfinished last line
+        streams = {
+            process.stdout: {"inform": "output", "label": "Output:", "decoder": codecs.getincrementaldecoder("utf-8")("replace"), "parts": [], "partial": ""},
+            process.stderr: {"inform": "error", "label": "Error:", "decoder": codecs.getincrementaldecoder("utf-8")("replace"), "parts": [], "partial": ""},
+        }
+        last_inform = None  # Stream whose label was printed last
 
-        if result.stderr:
-            output += f"{result.stderr}"
-            display("error", f"Error:|set|{result.stderr}")
+        try:
+            with selectors.DefaultSelector() as selector:
+                for pipe in streams:
+                    selector.register(pipe, selectors.EVENT_READ)
+
+                while selector.get_map():
+                    for key, _ in selector.select():
+                        stream = streams[key.fileobj]
+                        data = os.read(key.fd, 65536)
+                        if data:
+                            text = stream["decoder"].decode(data)
+                        else:
+                            # EOF on this pipe, flush the decoder and any unterminated line
+                            selector.unregister(key.fileobj)
+                            text = stream["decoder"].decode(b"", final=True)
+
+                        stream["parts"].append(text)
+                        *lines, stream["partial"] = (stream["partial"] + text).split("\n")
+                        if not data and stream["partial"]:
+                            lines.append(stream["partial"])
+                        if lines and stream["inform"] != last_inform:
+                            # Label each run of output, as stdout and stderr can interleave
+                            display(stream["inform"], stream["label"])
+                            last_inform = stream["inform"]
+                        for line in lines:
+                            # Printed directly, command output is arbitrary text and may contain markup or "|set|"
+                            console.print(escape(line), style=style_dict[stream["inform"]])
+
+            process.wait()
+        finally:
+            # Never leave the command running behind us on an error or Ctrl-C
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            process.stdout.close()
+            process.stderr.close()
+
+        output = "".join(streams[process.stdout]["parts"]) + "".join(streams[process.stderr]["parts"])
 
         # Append the command and its output to messages for history
         messages.append({"role": "user", "content": f"$ {command}\n{output.strip()}"})
         return output.strip()
 
+    except KeyboardInterrupt:
+        # Ctrl-C stops the running command, not the chat session
+        error_message = "Command interrupted."
+        display("error", error_message)
+        messages.append({"role": "user", "content": f"$ {command}\n{error_message}"})
+        return error_message
+
     except Exception as e:
         error_message = f"Command execution error: {e}"
-        display("error", f"{error_message}")
+        display("error", escape(error_message))
         # Append the error to messages for history
         messages.append({"role": "user", "content": f"$ {command}\n{error_message}"})
         return error_message
@@ -0,0 +1,14 @@
+#!/usr/bin/env python3
+# echoai PDF page extraction
+# Author: Wadih Khairallah
+#
+# Kept free of import-time side effects: worker processes started with the
+# spawn or forkserver method import this module, not the whole app.
+
+import io
+import PyPDF2
+
+def extract_pdf_pages(pdf_bytes, start, stop):
+    """Extract the text of pages [start, stop) from an in-memory PDF."""
+    pdf_reader = PyPDF2.PdfReader(io.BytesIO(pdf_bytes))
+    return "".join(pdf_reader.pages[i].extract_text() or "" for i in range(start, stop))